@@ -1,7 +1,16 @@
 import snowflake.connector
+import hashlib
+import io
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard as zstd
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from lxml import etree
 from pathlib import Path
 
 # Snowflake connection configuration
@@ -14,81 +23,246 @@ conn = snowflake.connector.connect(
     schema="PROJECTSCHEMA"
 )
 
-cs = conn.cursor()
-
-cs.execute("CREATE DATABASE IF NOT EXISTS projectdb")
-
-cs.execute("CREATE SCHEMA IF NOT EXISTS projectschema")
-
+# Adjacent statements below are sent as one multi-statement request
+# (num_statements=0 lets the server accept any count) to save round trips.
+# CREATE DATABASE/SCHEMA also make them current, so no USE statements are needed.
 with conn.cursor() as cs:
-    cs.execute("CREATE STAGE IF NOT EXISTS pgstage")
+    cs.execute("""
+        CREATE DATABASE IF NOT EXISTS projectdb;
+        CREATE SCHEMA IF NOT EXISTS projectschema;
+        CREATE STAGE IF NOT EXISTS pgstage;
+        CREATE TABLE IF NOT EXISTS ingest_manifest (
+            file      STRING,
+            sha256    STRING,
+            loaded_at TIMESTAMP_NTZ
+        );
+    """, num_statements=0)
+
+# ingest_manifest records the content hash of every source file that was loaded,
+# keyed "<stage subdir>/<file name>", so unchanged files are not re-staged.
+def file_sha256(path, block=1 << 20):
+    """Hex SHA-256 of a file, read in 1 MiB blocks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def manifest_hashes(cs, prefix):
+    """{file: sha256} already recorded in ingest_manifest under prefix/."""
+    cs.execute("SELECT file, sha256 FROM ingest_manifest WHERE STARTSWITH(file, %s)", (prefix + "/",))
+    return dict(cs.fetchall())
+
+def table_row_count(cs, name_upper):
+    """Row count of table name_upper in the current schema, or None if it does not exist."""
+    cs.execute("SHOW TABLES LIKE %s", (name_upper,))
+    cols = [d[0].lower() for d in cs.description]
+    i_name, i_rows = cols.index("name"), cols.index("rows")
+    for r in cs.fetchall():
+        # LIKE treats '_' as a wildcard, so confirm the exact name
+        if r[i_name].upper() == name_upper:
+            return r[i_rows]
+    return None
+
+def record_manifest(cs, hashes):
+    """Upsert {file: sha256} into ingest_manifest after a successful load."""
+    if not hashes:
+        return
+    values = ", ".join(["(%s, %s)"] * len(hashes))
+    cs.execute(f"""
+        MERGE INTO ingest_manifest m
+        USING (SELECT column1 AS file, column2 AS sha256 FROM VALUES {values}) s
+          ON m.file = s.file
+        WHEN MATCHED THEN UPDATE SET sha256 = s.sha256, loaded_at = CURRENT_TIMESTAMP()
+        WHEN NOT MATCHED THEN INSERT (file, sha256, loaded_at)
+            VALUES (s.file, s.sha256, CURRENT_TIMESTAMP())
+    """, [v for item in hashes.items() for v in item])
 
 # ==============================================================================
-# SECTION 1: Load XML Data (Supplier Transactions)
+# SECTION 1: Stage XML Data (Supplier Transactions) as Parquet
 # ==============================================================================
 
 XML_FILE = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/Supplier Transactions XML.xml"
+INV_PARQUET_DIR = Path("/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/supplier_invoice_parquet")
+
+def _to_int(text):
+    return int(text)
+
+_DECIMAL_LIMIT = Decimal(10) ** 14  # NUMBER(18,4) leaves 14 integer digits
+
+def _to_decimal(text):
+    value = Decimal(text).quantize(Decimal("0.0001"))
+    # NaN/Infinity and out-of-range amounts would abort the Arrow batch; TRY_TO_NUMBER gave NULL
+    if not value.is_finite() or abs(value) >= _DECIMAL_LIMIT:
+        raise ValueError(f"not a NUMBER(18,4): {text!r}")
+    return value
+
+def _to_date(text):
+    return date.fromisoformat(text[:10])
+
+def _to_flag(text):
+    return int(text) == 1
+
+def _to_timestamp(text):
+    # source is 'YYYY-MM-DD HH24:MI:SS.FF7'; Python keeps 6 fractional digits
+    return datetime.fromisoformat(text[:26])
+
+# XML tag -> (column, arrow type, converter); mirrors supplier_invoice_data in Section 6
+SUPPLIER_INVOICE_FIELDS = {
+    "SupplierTransactionID": ("supplier_transaction_id", pa.int64(),          _to_int),
+    "SupplierID":            ("supplier_id",             pa.int64(),          _to_int),
+    "TransactionTypeID":     ("transaction_type_id",     pa.int64(),          _to_int),
+    "PurchaseOrderID":       ("purchase_order_id",       pa.int64(),          _to_int),
+    "PaymentMethodID":       ("payment_method_id",       pa.int64(),          _to_int),
+    "SupplierInvoiceNumber": ("supplier_invoice_number", pa.string(),         str),
+    "TransactionDate":       ("transaction_date",        pa.date32(),         _to_date),
+    "AmountExcludingTax":    ("amount_excluding_tax",    pa.decimal128(18, 4), _to_decimal),
+    "TaxAmount":             ("tax_amount",              pa.decimal128(18, 4), _to_decimal),
+    "TransactionAmount":     ("transaction_amount",      pa.decimal128(18, 4), _to_decimal),
+    "OutstandingBalance":    ("outstanding_balance",     pa.decimal128(18, 4), _to_decimal),
+    "FinalizationDate":      ("finalization_date",       pa.date32(),         _to_date),
+    "IsFinalized":           ("is_finalized",            pa.bool_(),          _to_flag),
+    "LastEditedBy":          ("last_edited_by",          pa.int64(),          _to_int),
+    "LastEditedWhen":        ("last_edited_when",        pa.timestamp("us"),  _to_timestamp),
+}
+
+SUPPLIER_INVOICE_SCHEMA = pa.schema([(col, typ) for col, typ, _ in SUPPLIER_INVOICE_FIELDS.values()])
+
+# XML tag -> (position in SUPPLIER_INVOICE_SCHEMA, converter), resolved once
+_FIELD_SLOTS = {tag: (i, convert)
+                for i, (tag, (_, _, convert)) in enumerate(SUPPLIER_INVOICE_FIELDS.items())}
+_ID_SLOT = _FIELD_SLOTS["SupplierTransactionID"][0]
+
+class SupplierRowTarget:
+    """lxml parser target: collects each <row> as a typed list in schema order
+    without ever building Element objects. Like XMLGET, only direct children
+    of <row> fill fields; anything nested deeper is ignored."""
+
+    def __init__(self):
+        self.rows = []
+        self._rec = None
+        self._depth = 0     # 0 = the <row> itself, 1 = a field element
+        self._slot = None
+        self._buf = []
+
+    def start(self, tag, attrib):
+        if self._rec is None:
+            if tag == "row":
+                self._rec = [None] * len(_FIELD_SLOTS)
+                self._depth = 0
+            return
+        self._depth += 1
+        if self._depth == 1:
+            self._slot = _FIELD_SLOTS.get(tag)
+            self._buf.clear()
+
+    def data(self, text):
+        if self._slot is not None and self._depth == 1:
+            self._buf.append(text)
+
+    def end(self, tag):
+        if self._rec is None:
+            return
+        if self._depth == 0:
+            if self._rec[_ID_SLOT] is not None:
+                self.rows.append(self._rec)
+            self._rec = None
+            return
+        if self._depth == 1 and self._slot is not None:
+            i, convert = self._slot
+            if self._buf:
+                try:
+                    self._rec[i] = convert("".join(self._buf).strip())
+                except (ValueError, InvalidOperation):
+                    pass
+            self._slot = None
+        self._depth -= 1
 
-with conn.cursor() as cs:
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-    cs.execute("CREATE FILE FORMAT IF NOT EXISTS xml_fmt TYPE=XML")
-    cs.execute("CREATE TABLE IF NOT EXISTS supplier_transactions_raw (doc VARIANT)")
-
-    # upload the local XML (no gzip), then load it
-    cs.execute(f"PUT 'file://{XML_FILE}' @pgstage AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
-    cs.execute("COPY INTO supplier_transactions_raw "
-               "FROM @pgstage FILE_FORMAT=(FORMAT_NAME=xml_fmt) "
-               "PATTERN='.*Supplier Transactions XML\\.xml'")
-
-print("XML loaded into projectdb.projectschema.supplier_transactions_raw")
+    def close(self):
+        pass
 
-# Create view for supplier transactions
-with conn.cursor() as cs:
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-
-    cs.execute("""
-        CREATE OR REPLACE VIEW supplier_transactions AS
-        WITH row_nodes AS (
-          SELECT XMLGET(s.doc, 'row', f.value::NUMBER) AS v
-          FROM supplier_transactions_raw s,
-               LATERAL FLATTEN(input => TO_ARRAY(GET(s.doc, 'row'))) f
-        )
-        SELECT
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'SupplierTransactionID'):"$")) AS supplier_transaction_id,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'SupplierID'):"$"))            AS supplier_id,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TransactionTypeID'):"$"))     AS transaction_type_id,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'PurchaseOrderID'):"$"))       AS purchase_order_id,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'PaymentMethodID'):"$"))       AS payment_method_id,
-          TO_VARCHAR(XMLGET(v,'SupplierInvoiceNumber'):"$")                AS supplier_invoice_number,
-          TRY_TO_DATE(TO_VARCHAR(XMLGET(v,'TransactionDate'):"$"))         AS transaction_date,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'AmountExcludingTax'):"$"))    AS amount_excluding_tax,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TaxAmount'):"$"))             AS tax_amount,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TransactionAmount'):"$"))     AS transaction_amount,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'OutstandingBalance'):"$"))    AS outstanding_balance,
-          TRY_TO_DATE(TO_VARCHAR(XMLGET(v,'FinalizationDate'):"$"))        AS finalization_date,
-          (TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'IsFinalized'):"$")) = 1)     AS is_finalized,
-          TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'LastEditedBy'):"$"))          AS last_edited_by,
-          TRY_TO_TIMESTAMP_NTZ(
-            TO_VARCHAR(XMLGET(v,'LastEditedWhen'):"$"),
-            'YYYY-MM-DD HH24:MI:SS.FF7'
-          ) AS last_edited_when
-        FROM row_nodes
-        WHERE XMLGET(v,'SupplierTransactionID') IS NOT NULL
-    """)
-
-    # sanity peek
-    cs.execute("SELECT COUNT(*) FROM supplier_transactions")
-    print("rows:", cs.fetchone()[0])
-    cs.execute("""
-        SELECT supplier_transaction_id, supplier_id, transaction_amount, transaction_date
-        FROM supplier_transactions
-        WHERE supplier_transaction_id IS NOT NULL
-        ORDER BY supplier_transaction_id
-        LIMIT 10
-    """)
-    print(cs.fetchall())
+def iter_supplier_rows(path, chunk_size=4 << 20):
+    """Stream <row> elements as typed lists in schema order; unparseable values become None (like TRY_TO_*)."""
+    target = SupplierRowTarget()
+    # huge_tree lifts libxml2's size limits for multi-GB exports; no entity
+    # expansion or ID table is needed for flat <row> records
+    parser = etree.XMLParser(target=target, huge_tree=True, resolve_entities=False,
+                             collect_ids=False, remove_blank_text=True)
+    with open(path, "rb", buffering=0) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            parser.feed(chunk)
+            yield from target.rows
+            target.rows.clear()
+    parser.close()
+    yield from target.rows
+
+def write_supplier_parquet(rows, out_dir, rows_per_file=1_000_000, batch_rows=100_000):
+    """Write typed rows (schema-ordered lists) as zstd Parquet shards inv_00000.parquet, ...; returns the row count.
+
+    Shards stay well under ~250 MB uncompressed so PUT can upload them
+    concurrently and COPY can load them in parallel.
+    """
+    for old in out_dir.glob("inv_*.parquet"):
+        old.unlink()
+
+    n = 0
+    shard = 0
+    writer = None
+    # one list per column, so each batch converts straight to Arrow arrays
+    cols = {name: [] for name in SUPPLIER_INVOICE_SCHEMA.names}
+    pending = 0
+
+    def flush():
+        nonlocal n, shard, writer, pending
+        if writer is None:
+            writer = pq.ParquetWriter(out_dir / f"inv_{shard:05d}.parquet",
+                                      SUPPLIER_INVOICE_SCHEMA, compression="zstd")
+        writer.write_table(pa.Table.from_pydict(cols, schema=SUPPLIER_INVOICE_SCHEMA))
+        n += pending
+        pending = 0
+        for values in cols.values():
+            values.clear()
+        if n >= (shard + 1) * rows_per_file:
+            writer.close()
+            writer = None
+            shard += 1
+
+    for rec in rows:
+        for values, value in zip(cols.values(), rec):
+            values.append(value)
+        pending += 1
+        if pending >= batch_rows:
+            flush()
+    if pending or n == 0:
+        # an XML with no rows still gets one (empty) shard, so the PUT glob
+        # matches and Section 6's COPY loads an empty table instead of failing
+        flush()
+    if writer is not None:
+        writer.close()
+    return n
+
+def load_xml(conn):
+    """Section 1 body: parse the XML to Parquet shards and PUT them to @pgstage/inv."""
+    xml_hash = {"inv/" + Path(XML_FILE).name: file_sha256(XML_FILE)}
+    with conn.cursor() as cs:
+        # the shards from the last run are reused if the XML has not changed and
+        # they are still on the stage (it may have been recreated since)
+        cs.execute("LIST @pgstage/inv/ PATTERN='.*[.]parquet'")
+        if cs.fetchall() and manifest_hashes(cs, "inv") == xml_hash:
+            print("XML unchanged; keeping the Parquet shards at @pgstage/inv")
+            return
+
+    INV_PARQUET_DIR.mkdir(parents=True, exist_ok=True)
+    inv_rows = write_supplier_parquet(iter_supplier_rows(XML_FILE), INV_PARQUET_DIR)
+
+    with conn.cursor() as cs:
+        # typed Parquet shards are loaded straight into supplier_invoice_data in Section 6
+        cs.execute("REMOVE @pgstage/inv")
+        cs.execute(f"PUT 'file://{INV_PARQUET_DIR}/inv_*.parquet' @pgstage/inv AUTO_COMPRESS=FALSE PARALLEL=16 OVERWRITE=TRUE")
+        cs.execute("DELETE FROM ingest_manifest WHERE STARTSWITH(file, 'inv/')")
+        record_manifest(cs, xml_hash)
+
+    print(f"XML parsed ({inv_rows} rows) and staged at @pgstage/inv")
 
 
 # ==============================================================================
@@ -96,167 +270,356 @@ with conn.cursor() as cs:
 # ==============================================================================
 
 TXT_FILE = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/2021_Gaz_zcta_national.txt"
+ZSTD_DIR = Path("/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/zstd_out")
+
+def zstd_file(src, out_dir):
+    """Compress src into out_dir/<name>.zst (level 3) and return the new path."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    dst = out_dir / (Path(src).name + ".zst")
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        zstd.ZstdCompressor(level=3).copy_stream(fin, fout)
+    return dst
+
+def load_zcta(conn):
+    """Section 2 body: stage the ZCTA file, load zcta_2021_raw and define zcta_2021."""
+    zcta_hash = {"zcta/" + Path(TXT_FILE).name: file_sha256(TXT_FILE)}
+
+    with conn.cursor() as cs:
+        # Fixed DDL (the schema INFER_SCHEMA produced) for this static reference file
+        cs.execute("""
+            CREATE TABLE IF NOT EXISTS zcta_2021_raw (
+                "GEOID"       NUMBER(5,0),
+                "ALAND"       NUMBER(38,0),
+                "AWATER"      NUMBER(38,0),
+                "ALAND_SQMI"  NUMBER(38,3),
+                "AWATER_SQMI" NUMBER(38,3),
+                "INTPTLAT"    NUMBER(38,6),
+                "INTPTLONG"   NUMBER(38,6)
+            );
+
+            CREATE OR REPLACE VIEW zcta_2021 AS
+            SELECT
+                GEOID::STRING                            AS zcta5,
+                GEOID::STRING                            AS geoid,
+                ALAND                                     AS land_area_m2,   -- already NUMBER
+                AWATER                                    AS water_area_m2,  -- already NUMBER
+                ALAND_SQMI::FLOAT                         AS land_area_sqmi,
+                AWATER_SQMI::FLOAT                        AS water_area_sqmi,
+                TRY_TO_DOUBLE(NULLIF(TRIM(TO_VARCHAR(INTPTLAT)),  ''))  AS centroid_lat,
+                TRY_TO_DOUBLE(NULLIF(TRIM(TO_VARCHAR(INTPTLONG)), ''))  AS centroid_lon,
+                (ALAND_SQMI::FLOAT + AWATER_SQMI::FLOAT)  AS total_area_sqmi
+            FROM zcta_2021_raw;
+        """, num_statements=0)
+
+        # a dropped or recreated table comes back empty even if the manifest still
+        # matches, so only skip the reload when it actually has rows
+        cs.execute("SELECT COUNT(*) FROM zcta_2021_raw")
+        if cs.fetchone()[0] > 0 and manifest_hashes(cs, "zcta") == zcta_hash:
+            print("ZCTA file unchanged; keeping zcta_2021_raw")
+        else:
+            zcta_zst = zstd_file(TXT_FILE, ZSTD_DIR)
+
+            # Tab-delimited with header
+            cs.execute("""
+                CREATE OR REPLACE FILE FORMAT zcta_fmt
+                TYPE=CSV
+                FIELD_DELIMITER='\\t'
+                PARSE_HEADER=TRUE
+                TRIM_SPACE=TRUE
+                EMPTY_FIELD_AS_NULL=TRUE
+                NULL_IF=('','\\N','NULL')
+                COMPRESSION=ZSTD
+            """)
+
+            # Upload the zstd-compressed file and reload the table
+            # (match by column names from the header)
+            cs.execute(f"PUT 'file://{zcta_zst}' @pgstage SOURCE_COMPRESSION=ZSTD PARALLEL=16 OVERWRITE=TRUE")
+            cs.execute("""
+                TRUNCATE TABLE zcta_2021_raw;
+
+                COPY INTO zcta_2021_raw
+                FROM @pgstage/2021_Gaz_zcta_national.txt.zst
+                FILE_FORMAT=(FORMAT_NAME=zcta_fmt)
+                MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE
+                FORCE=TRUE;
+            """, num_statements=0)
+            record_manifest(cs, zcta_hash)
+
+        cs.execute("SELECT COUNT(*) FROM zcta_2021_raw")
+        print("Rows loaded:", cs.fetchone()[0])
+
+    print("Done.")
 
-with conn.cursor() as cs:
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-
-    # Tab-delimited with header
-    cs.execute("""
-        CREATE OR REPLACE FILE FORMAT zcta_fmt
-        TYPE=CSV
-        FIELD_DELIMITER='\\t'
-        PARSE_HEADER=TRUE
-        TRIM_SPACE=TRUE
-        EMPTY_FIELD_AS_NULL=TRUE
-        NULL_IF=('','\\N','NULL')
-    """)
-
-    # Upload the local file (no gzip)
-    cs.execute(f"PUT 'file://{TXT_FILE}' @pgstage AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
 
-    # Create table from the single staged file's inferred schema
-    cs.execute("""
-        CREATE OR REPLACE TABLE zcta_2021_raw USING TEMPLATE (
-          SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
-          FROM TABLE(
-            INFER_SCHEMA(
-              LOCATION=>'@pgstage/2021_Gaz_zcta_national.txt',
-              FILE_FORMAT=>'zcta_fmt'
-            )
-          )
-        )
-    """)
-
-    # Load the data (match by column names from the header)
-    cs.execute("""
-        COPY INTO zcta_2021_raw
-        FROM @pgstage/2021_Gaz_zcta_national.txt
-        FILE_FORMAT=(FORMAT_NAME=zcta_fmt)
-        MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE
-    """)
+# ==============================================================================
+# SECTION 3: Load Monthly PO Data (CSV Files)
+# ==============================================================================
 
-    cs.execute("SELECT COUNT(*) FROM zcta_2021_raw")
-    print("Rows loaded:", cs.fetchone()[0])
+CSV_DIR = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/Monthly PO Data"
+PO_ZSTD_DIR = ZSTD_DIR / "po_monthly"
 
-print("Done.")
+def copy_with_rejects(cs, table, copy_sql):
+    """COPY with ON_ERROR='ABORT_STATEMENT'; if that fails, reload with CONTINUE
+    and keep the rejected rows from VALIDATE in <table>_rejects."""
+    try:
+        cs.execute(copy_sql + "\nON_ERROR='ABORT_STATEMENT'")
+    except snowflake.connector.ProgrammingError:
+        cs.execute(copy_sql + "\nON_ERROR='CONTINUE'")
+        # by query id, not '_last': other loads share this session concurrently
+        cs.execute(f"""
+            CREATE OR REPLACE TABLE {table}_rejects AS
+            SELECT * FROM TABLE(VALIDATE({table}, JOB_ID => %s))
+        """, (cs.sfqid,))
+        cs.execute(f"SELECT COUNT(*) FROM {table}_rejects")
+        print(f"{table}: {cs.fetchone()[0]} rejected row(s) saved to {table}_rejects")
+
+def load_po(conn):
+    """Section 3 body: stage the monthly PO CSVs and load po_monthly."""
+    csv_paths = {p.name: p for p in sorted(Path(CSV_DIR).glob("*.csv"))}
+    hashes = {"po_monthly/" + name: file_sha256(p) for name, p in csv_paths.items()}
+
+    with conn.cursor() as cs:
+        seen = manifest_hashes(cs, "po_monthly")
+        changed = [f for f, h in hashes.items() if seen.get(f) != h]
+        # new months are appended; an edited or removed month, or a missing or
+        # empty po_monthly (dropped/truncated since the manifest was written),
+        # means a full rebuild
+        rebuild = (not seen or any(f in seen for f in changed)
+                   or not seen.keys() <= hashes.keys()
+                   or not table_row_count(cs, "PO_MONTHLY"))
+        if rebuild:
+            changed = list(hashes)
+        new_files = [f.split("/", 1)[1] for f in changed]
+
+        PO_ZSTD_DIR.mkdir(parents=True, exist_ok=True)
+        for old in PO_ZSTD_DIR.glob("*.csv.zst"):
+            old.unlink()
+        for name in new_files:
+            zstd_file(csv_paths[name], PO_ZSTD_DIR)
+
+        # 1) File format for COPY (header row) and, on a rebuild, a clean stage subdir
+        cs.execute("""
+            CREATE OR REPLACE FILE FORMAT po_csv_fmt
+            TYPE=CSV
+            PARSE_HEADER=TRUE
+            FIELD_OPTIONALLY_ENCLOSED_BY='"'
+            TRIM_SPACE=TRUE
+            EMPTY_FIELD_AS_NULL=TRUE
+            NULL_IF=('','\\N','NULL')
+            COMPRESSION=ZSTD
+        """)
+        if rebuild:
+            cs.execute("""
+                REMOVE @pgstage/po_monthly;
+                DELETE FROM ingest_manifest WHERE STARTSWITH(file, 'po_monthly/');
+            """, num_statements=0)
+
+        if not new_files:
+            print("Monthly PO CSVs unchanged; nothing to stage")
+        else:
+            # 2) Upload the new zstd-compressed CSVs to a subdir on the stage
+            cs.execute(f"PUT 'file://{PO_ZSTD_DIR}/*.csv.zst' @pgstage/po_monthly "
+                       "SOURCE_COMPRESSION=ZSTD PARALLEL=16 OVERWRITE=TRUE")
+
+            # 3) On a rebuild, create a single table from inferred schema across ALL
+            #    staged CSVs and cluster it on the Section 7 join key so invoice
+            #    lookups prune micro-partitions
+            if rebuild:
+                cs.execute("""
+                    CREATE OR REPLACE TABLE po_monthly USING TEMPLATE (
+                      SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
+                      FROM TABLE(
+                        INFER_SCHEMA(
+                          LOCATION=>'@pgstage/po_monthly',
+                          FILE_FORMAT=>'po_csv_fmt'
+                        )
+                      )
+                    );
+
+                    ALTER TABLE po_monthly CLUSTER BY ("SupplierID", "PurchaseOrderID");
+                """, num_statements=0)
+
+            # 4) Load only the newly staged files into that table (this "aggregates" all files)
+            files = ", ".join(f"'{name}.zst'" for name in new_files)
+            copy_with_rejects(cs, "po_monthly", f"""
+                COPY INTO po_monthly
+                FROM @pgstage/po_monthly
+                FILES=({files})
+                FILE_FORMAT=(FORMAT_NAME=po_csv_fmt)
+                MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE""")
+            record_manifest(cs, {f: hashes[f] for f in changed})
+
+        # 5) Quick verification
+        cs.execute("SELECT COUNT(*) AS total_row_count FROM po_monthly")
+        print(cs.fetchall())
 
-# Create ZCTA 2021 view
-with conn.cursor() as cs:
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-    cs.execute("""
-        CREATE OR REPLACE VIEW zcta_2021 AS
-        SELECT
-            GEOID::STRING                            AS zcta5,
-            GEOID::STRING                            AS geoid,
-            ALAND                                     AS land_area_m2,   -- already NUMBER
-            AWATER                                    AS water_area_m2,  -- already NUMBER
-            ALAND_SQMI::FLOAT                         AS land_area_sqmi,
-            AWATER_SQMI::FLOAT                        AS water_area_sqmi,
-            TRY_TO_DOUBLE(NULLIF(TRIM(TO_VARCHAR(INTPTLAT)),  ''))  AS centroid_lat,
-            TRY_TO_DOUBLE(NULLIF(TRIM(TO_VARCHAR(INTPTLONG)), ''))  AS centroid_lon,
-            (ALAND_SQMI::FLOAT + AWATER_SQMI::FLOAT)  AS total_area_sqmi
-        FROM zcta_2021_raw
-    """)
+        cs.execute("""
+            SELECT
+              COUNT(DISTINCT FILE_NAME) AS files_loaded,
+              SUM(ROW_COUNT)           AS total_row_count
+            FROM TABLE(
+              INFORMATION_SCHEMA.COPY_HISTORY(
+                TABLE_NAME => 'PROJECTDB.PROJECTSCHEMA.PO_MONTHLY',
+                START_TIME => DATEADD('year', -1, CURRENT_TIMESTAMP())
+              )
+            )
+        """)
+        print(cs.fetchall())
 
 
 # ==============================================================================
-# SECTION 3: Load Monthly PO Data (CSV Files)
+# SECTION 4: PostgreSQL Integration - Supplier Case Data
 # ==============================================================================
 
-CSV_DIR = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/Monthly PO Data"
-
-with conn.cursor() as cs:
-    # scope & one-time objects
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-    cs.execute("CREATE STAGE IF NOT EXISTS pgstage")
-
-    # 1) File format for COPY (header row)
-    cs.execute("""
-        CREATE OR REPLACE FILE FORMAT po_csv_fmt
-        TYPE=CSV
-        PARSE_HEADER=TRUE
-        FIELD_OPTIONALLY_ENCLOSED_BY='"'
-        TRIM_SPACE=TRUE
-        EMPTY_FIELD_AS_NULL=TRUE
-        NULL_IF=('','\\N','NULL')
-    """)
+PG = dict(
+    host="127.0.0.1",        # or your PG host
+    port=8765,
+    dbname="rsm-docker",
+    user="jovyan",
+    password="postgres",
+)
 
-    # 2) Upload all CSVs from the folder to a subdir on the stage
-    cs.execute(f"PUT 'file://{CSV_DIR}/*.csv' @pgstage/po_monthly AUTO_COMPRESS=FALSE OVERWRITE=TRUE")
+SQL_FILE = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/supplier_case.pgsql"
 
-    # 3) Create a single table from inferred schema across ALL staged CSVs
-    cs.execute("""
-        CREATE OR REPLACE TABLE po_monthly USING TEMPLATE (
-          SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
-          FROM TABLE(
-            INFER_SCHEMA(
-              LOCATION=>'@pgstage/po_monthly',
-              FILE_FORMAT=>'po_csv_fmt'
+class StagedZstdParts:
+    """Write-only sink for COPY ... TO STDOUT WITH CSV HEADER: zstd-compresses
+    the stream into parts of about part_bytes of CSV each (header repeated) and
+    PUTs every finished part, so memory stays bounded by one compressed part."""
+
+    def __init__(self, cs, stage_path, name, part_bytes=256 << 20):
+        self.cs = cs
+        self.stage_path = stage_path
+        self.name = name
+        self.part_bytes = part_bytes
+        self.parts = 0
+        self.header = None
+        self._buf = None
+        self._zw = None
+        self._size = 0
+
+    def write(self, data):
+        # COPY TO sends one CopyData message per CSV row (header first) and
+        # psycopg2 writes each as it arrives, so rotating here never splits a row
+        if self.header is None:
+            self.header = data
+            return
+        if self._zw is None:
+            self._open()
+        self._zw.write(data)
+        self._size += len(data)
+        if self._size >= self.part_bytes:
+            self._put()
+
+    def _open(self):
+        self._buf = io.BytesIO()
+        self._zw = zstd.ZstdCompressor(level=3).stream_writer(self._buf, closefd=False)
+        self._zw.write(self.header)
+        self._size = len(self.header)
+
+    def _put(self):
+        self._zw.close()
+        self._buf.seek(0)
+        # the file name in the PUT only names the staged object
+        self.cs.execute(f"PUT 'file://{self.name}_{self.parts:05d}.csv.zst' {self.stage_path} "
+                        "OVERWRITE=TRUE SOURCE_COMPRESSION=ZSTD",
+                        file_stream=self._buf)
+        self.parts += 1
+        self._buf = None
+        self._zw = None
+
+    def close(self):
+        """PUT the last partial part (or a header-only part for an empty table)."""
+        if self._zw is None and self.parts == 0 and self.header is not None:
+            self._open()
+        if self._zw is not None:
+            self._put()
+
+def load_pg(conn):
+    """Section 4 body: build supplier_case in Postgres and stream it into Snowflake."""
+    env = os.environ.copy()
+    env.update({
+        "PGHOST": PG["host"],
+        "PGPORT": str(PG["port"]),
+        "PGUSER": PG["user"],
+        "PGDATABASE": PG["dbname"],
+        "PGPASSWORD": PG["password"],
+    })
+
+    subprocess.run(["psql", "-f", SQL_FILE], check=True, env=env)
+    print("✓ Ran supplier_case.pgsql into Postgres.")
+
+    # Load supplier_case into Snowflake
+    with conn.cursor() as cs:
+        cs.execute("""
+            CREATE OR REPLACE FILE FORMAT csv_std
+            TYPE=CSV
+            PARSE_HEADER=TRUE
+            FIELD_OPTIONALLY_ENCLOSED_BY='"'
+            TRIM_SPACE=TRUE
+            EMPTY_FIELD_AS_NULL=TRUE
+            NULL_IF=('','\\N','NULL')
+            COMPRESSION=ZSTD;
+
+            REMOVE @pgstage/supplier_case;
+        """, num_statements=0)
+
+        # Stream COPY ... TO STDOUT into zstd parts that are PUT as they fill
+        # (nothing touches disk); COPY below then loads the parts in parallel
+        parts = StagedZstdParts(cs, "@pgstage/supplier_case", "supplier_case")
+        with psycopg2.connect(**PG) as pg_conn:
+            with pg_conn.cursor() as cur:
+                # schema-qualify; default is public unless your script chose another
+                cur.copy_expert("COPY public.supplier_case TO STDOUT WITH CSV HEADER", parts)
+        parts.close()
+        print(f"✓ Exported supplier_case ({parts.parts} zstd part(s) staged)")
+
+        # Create the table from the file's inferred schema, then load the data
+        cs.execute("""
+            CREATE OR REPLACE TABLE supplier_case USING TEMPLATE (
+              SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
+              FROM TABLE(
+                INFER_SCHEMA(
+                  LOCATION=>'@pgstage/supplier_case/',
+                  FILE_FORMAT=>'csv_std'
+                )
+              )
             )
-          )
-        )
-    """)
-
-    # 4) Load everything into that table (this "aggregates" all files)
-    cs.execute("""
-        COPY INTO po_monthly
-        FROM @pgstage/po_monthly
-        FILE_FORMAT=(FORMAT_NAME=po_csv_fmt)
-        MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE
-        ON_ERROR='CONTINUE'
-    """)
+        """)
 
-    # 5) Quick verification
-    cs.execute("SELECT COUNT(*) AS total_row_count FROM po_monthly")
-    print(cs.fetchall())
+        copy_with_rejects(cs, "supplier_case", """
+            COPY INTO supplier_case
+            FROM @pgstage/supplier_case/
+            FILE_FORMAT=(FORMAT_NAME=csv_std)
+            MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE""")
 
-    cs.execute("""
-        SELECT
-          COUNT(DISTINCT FILE_NAME) AS files_loaded,
-          SUM(ROW_COUNT)           AS total_row_count
-        FROM TABLE(
-          INFORMATION_SCHEMA.COPY_HISTORY(
-            TABLE_NAME => 'PROJECTDB.PROJECTSCHEMA.PO_MONTHLY',
-            START_TIME => DATEADD('year', -1, CURRENT_TIMESTAMP())
-          )
-        )
-    """)
-    print(cs.fetchall())
+        cs.execute("SELECT COUNT(*) FROM supplier_case")
+        print("row_count:", cs.fetchone()[0])
 
 
 # ==============================================================================
-# SECTION 4: Add POAmount Column
+# SECTION 5: Run Staging Loads Concurrently
 # ==============================================================================
 
-with conn.cursor() as cs:
-    cs.execute("""
-        ALTER TABLE po_monthly
-        ADD COLUMN "POAmount" NUMBER(18,2)
-    """)
-
-
-with conn.cursor() as cs:
-    cs.execute("""
-    UPDATE po_monthly
-    SET "POAmount" = ROUND(
-            COALESCE("ReceivedOuters", 0)
-        * COALESCE("ExpectedUnitPricePerOuter", 0)
-        , 2)
-    """)
+# Sections 1-4 have no data dependency on each other, so their PUT/COPY work
+# overlaps on separate cursors of the shared connection. Sections 6-9 read
+# their tables: leaving the with block waits for all four, and result()
+# re-raises any failure before moving on.
+with ThreadPoolExecutor(max_workers=4) as pool:
+    staging = [pool.submit(f, conn) for f in (load_xml, load_zcta, load_po, load_pg)]
+    for fut in staging:
+        fut.result()
 
 
 # ==============================================================================
-# SECTION 5: Create Supplier Invoice Data Table
+# SECTION 6: Create Supplier Invoice Data Table
 # ==============================================================================
 
 with conn.cursor() as cs:
-    # 1) Create the final typed table (one row per invoice)
+    # 1) Create the final typed table (one row per invoice) and 2) load the Parquet
+    #    staged in Section 1 (columns already typed client-side)
     cs.execute("""
         CREATE OR REPLACE TABLE supplier_invoice_data (
-            supplier_transaction_id NUMBER,
+            supplier_transaction_id NUMBER NOT NULL,
             supplier_id             NUMBER,
             transaction_type_id     NUMBER,
             purchase_order_id       NUMBER,
@@ -272,43 +635,18 @@ with conn.cursor() as cs:
             last_edited_by          NUMBER,
             last_edited_when        TIMESTAMP_NTZ
         )
-    """)
+        CLUSTER BY (supplier_id, purchase_order_id);
 
-with conn.cursor() as cs:
-    # 2) Shred from RAW (doc VARIANT) into the typed table using INSERT ... SELECT
-    cs.execute("""
-        INSERT INTO supplier_invoice_data
-        SELECT
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'SupplierTransactionID'):"$")) AS supplier_transaction_id,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'SupplierID'):"$"))            AS supplier_id,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TransactionTypeID'):"$"))     AS transaction_type_id,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'PurchaseOrderID'):"$"))       AS purchase_order_id,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'PaymentMethodID'):"$"))       AS payment_method_id,
-            TO_VARCHAR(XMLGET(v,'SupplierInvoiceNumber'):"$")                AS supplier_invoice_number,
-            TRY_TO_DATE(TO_VARCHAR(XMLGET(v,'TransactionDate'):"$"))         AS transaction_date,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'AmountExcludingTax'):"$"))    AS amount_excluding_tax,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TaxAmount'):"$"))             AS tax_amount,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'TransactionAmount'):"$"))     AS transaction_amount,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'OutstandingBalance'):"$"))    AS outstanding_balance,
-            TRY_TO_DATE(TO_VARCHAR(XMLGET(v,'FinalizationDate'):"$"))        AS finalization_date,
-            (TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'IsFinalized'):"$")) = 1)     AS is_finalized,
-            TRY_TO_NUMBER(TO_VARCHAR(XMLGET(v,'LastEditedBy'):"$"))          AS last_edited_by,
-            TRY_TO_TIMESTAMP_NTZ(
-              TO_VARCHAR(XMLGET(v,'LastEditedWhen'):"$"),
-              'YYYY-MM-DD HH24:MI:SS.FF7'
-            ) AS last_edited_when
-        FROM supplier_transactions_raw r,
-             LATERAL FLATTEN(input => TO_ARRAY(GET(r.doc,'row'))) f,
-             LATERAL (SELECT XMLGET(r.doc,'row', f.value::NUMBER)) t(v)
-        WHERE XMLGET(v,'SupplierTransactionID') IS NOT NULL
-    """)
+        COPY INTO supplier_invoice_data
+        FROM @pgstage/inv
+        FILE_FORMAT=(TYPE=PARQUET USE_LOGICAL_TYPE=TRUE)
+        MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE;
+    """, num_statements=0)
 
-with conn.cursor() as cs:
-   # 3) Quick checks
+    # 3) Quick checks
     cs.execute("SELECT COUNT(*) FROM supplier_invoice_data")
     print("rows:", cs.fetchone()[0])
 
-
     cs.execute("""
         SELECT supplier_transaction_id, supplier_id, transaction_amount, transaction_date
         FROM supplier_invoice_data
@@ -319,81 +657,54 @@ with conn.cursor() as cs:
 
 
 # ==============================================================================
-# SECTION 6: Create Purchase Orders and Invoices View/Table
+# SECTION 7: Create Purchase Orders and Invoices View/Table
 # ==============================================================================
 
+# Shared by the MV attempt and the TABLE fallback below. The PO total is
+# summed and cast once in po_agg; the outer SELECT only references it.
+PO_INV_SELECT = """
+    WITH po_agg AS (
+      -- one row per (PO, supplier) before the join, instead of grouping the joined rows
+      SELECT
+          m."PurchaseOrderID" AS purchase_order_id,
+          m."SupplierID"      AS supplier_id,
+          CAST(
+            SUM(
+              ROUND(COALESCE(m."ReceivedOuters", 0) * COALESCE(m."ExpectedUnitPricePerOuter", 0), 2)
+            ) AS NUMBER(18,2)
+          ) AS po_total
+      FROM po_monthly m
+      GROUP BY m."PurchaseOrderID", m."SupplierID"
+    )
+    SELECT
+        i.supplier_transaction_id,
+        i.supplier_id,
+        i.purchase_order_id,
+        i.transaction_date,
+        a.po_total                                   AS po_total_amount,
+        CAST(i.amount_excluding_tax AS NUMBER(18,2)) AS amount_excluding_tax,
+        CAST(
+          a.po_total - COALESCE(i.amount_excluding_tax, 0)
+          AS NUMBER(18,2)
+        ) AS invoiced_vs_quoted
+    FROM supplier_invoice_data i
+    JOIN po_agg a
+      ON a.purchase_order_id = i.purchase_order_id
+     AND a.supplier_id       = i.supplier_id
+"""
+
 with conn.cursor() as cs:
     # 5) Using purchases + invoices, compute PO totals and invoiced_vs_quoted
+    # POAmount (ReceivedOuters * ExpectedUnitPricePerOuter, rounded per line) is
+    # derived here rather than written back into po_monthly with ALTER + UPDATE.
     # Try to create an MV named purchase_orders_and_invoices (base tables only).
     # If MV creation is not supported in your edition, create a TABLE instead.
     try:
-        cs.execute("""
-            CREATE OR REPLACE MATERIALIZED VIEW purchase_orders_and_invoices AS
-            SELECT
-                i.supplier_transaction_id,
-                i.supplier_id,
-                i.purchase_order_id,
-                i.transaction_date,
-                CAST(
-                  SUM(
-                    COALESCE(m."POAmount",
-                             COALESCE(m."ReceivedOuters", 0) * COALESCE(m."ExpectedUnitPricePerOuter", 0))
-                  ) AS NUMBER(18,2)
-                ) AS po_total_amount,
-                CAST(i.amount_excluding_tax AS NUMBER(18,2)) AS amount_excluding_tax,
-                CAST(
-                  SUM(
-                    COALESCE(m."POAmount",
-                             COALESCE(m."ReceivedOuters", 0) * COALESCE(m."ExpectedUnitPricePerOuter", 0))
-                  ) - COALESCE(i.amount_excluding_tax, 0)
-                  AS NUMBER(18,2)
-                ) AS invoiced_vs_quoted
-            FROM supplier_invoice_data i
-            JOIN po_monthly m
-              ON m."PurchaseOrderID" = i.purchase_order_id
-             AND m."SupplierID"      = i.supplier_id
-            GROUP BY
-                i.supplier_transaction_id,
-                i.supplier_id,
-                i.purchase_order_id,
-                i.transaction_date,
-                i.amount_excluding_tax
-        """)
+        cs.execute("CREATE OR REPLACE MATERIALIZED VIEW purchase_orders_and_invoices AS" + PO_INV_SELECT)
         print("✓ Created MATERIALIZED VIEW purchase_orders_and_invoices")
     except Exception:
         cs.execute("DROP TABLE IF EXISTS purchase_orders_and_invoices")
-        cs.execute("""
-            CREATE TABLE purchase_orders_and_invoices AS
-            SELECT
-                i.supplier_transaction_id,
-                i.supplier_id,
-                i.purchase_order_id,
-                i.transaction_date,
-                CAST(
-                  SUM(
-                    COALESCE(m."POAmount",
-                             COALESCE(m."ReceivedOuters", 0) * COALESCE(m."ExpectedUnitPricePerOuter", 0))
-                  ) AS NUMBER(18,2)
-                ) AS po_total_amount,
-                CAST(i.amount_excluding_tax AS NUMBER(18,2)) AS amount_excluding_tax,
-                CAST(
-                  SUM(
-                    COALESCE(m."POAmount",
-                             COALESCE(m."ReceivedOuters", 0) * COALESCE(m."ExpectedUnitPricePerOuter", 0))
-                  ) - COALESCE(i.amount_excluding_tax, 0)
-                  AS NUMBER(18,2)
-                ) AS invoiced_vs_quoted
-            FROM supplier_invoice_data i
-            JOIN po_monthly m
-              ON m."PurchaseOrderID" = i.purchase_order_id
-             AND m."SupplierID"      = i.supplier_id
-            GROUP BY
-                i.supplier_transaction_id,
-                i.supplier_id,
-                i.purchase_order_id,
-                i.transaction_date,
-                i.amount_excluding_tax
-        """)
+        cs.execute("CREATE TABLE purchase_orders_and_invoices AS" + PO_INV_SELECT)
         print("✓ Created TABLE purchase_orders_and_invoices (fallback)")
 
 with conn.cursor() as cs:
@@ -407,118 +718,35 @@ with conn.cursor() as cs:
     """); print(cs.fetchall())
 
 
-# ==============================================================================
-# SECTION 7: PostgreSQL Integration - Supplier Case Data
-# ==============================================================================
-
-PG = dict(
-    host="127.0.0.1",        # or your PG host
-    port=8765,
-    dbname="rsm-docker",
-    user="jovyan",
-    password="postgres",
-)
-
-SQL_FILE = "/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/supplier_case.pgsql"
-
-env = os.environ.copy()
-env.update({
-    "PGHOST": PG["host"],
-    "PGPORT": str(PG["port"]),
-    "PGUSER": PG["user"],
-    "PGDATABASE": PG["dbname"],
-    "PGPASSWORD": PG["password"],
-})
-
-subprocess.run(["psql", "-f", SQL_FILE], check=True, env=env)
-print("✓ Ran supplier_case.pgsql into Postgres.")
-
-
-CSV_OUT = Path("/home/jovyan/Downloads/rsm-ict/python/DataForSnowflakeProj/supplier_case.csv")
-
-with psycopg2.connect(**PG) as pg_conn:
-    with pg_conn.cursor() as cur, open(CSV_OUT, "w", newline="") as f:
-        # schema-qualify; default is public unless your script chose another
-        cur.copy_expert("COPY public.supplier_case TO STDOUT WITH CSV HEADER", f)
-
-print(f"✓ Exported to {CSV_OUT}")
-
-# Load supplier_case into Snowflake
-with conn.cursor() as cs:
-    cs.execute("USE DATABASE projectdb")
-    cs.execute("USE SCHEMA projectschema")
-    cs.execute("CREATE STAGE IF NOT EXISTS pgstage")
-
-    cs.execute("""
-        CREATE OR REPLACE FILE FORMAT csv_std
-        TYPE=CSV
-        PARSE_HEADER=TRUE
-        FIELD_OPTIONALLY_ENCLOSED_BY='"'
-        TRIM_SPACE=TRUE
-        EMPTY_FIELD_AS_NULL=TRUE
-        NULL_IF=('','\\N','NULL')
-    """)
-
-    # Upload the CSV
-    cs.execute(f"PUT 'file://{CSV_OUT}' @pgstage OVERWRITE=TRUE AUTO_COMPRESS=FALSE")
-
-    # Create the table from the file's inferred schema
-    cs.execute("""
-        CREATE OR REPLACE TABLE supplier_case USING TEMPLATE (
-          SELECT ARRAY_AGG(OBJECT_CONSTRUCT(*))
-          FROM TABLE(
-            INFER_SCHEMA(
-              LOCATION=>'@pgstage/supplier_case.csv',
-              FILE_FORMAT=>'csv_std'
-            )
-          )
-        )
-    """)
-
-    # Load the data
-    cs.execute("""
-        COPY INTO supplier_case
-        FROM @pgstage/supplier_case.csv
-        FILE_FORMAT=(FORMAT_NAME=csv_std)
-        MATCH_BY_COLUMN_NAME=CASE_INSENSITIVE
-        ON_ERROR='CONTINUE'
-    """)
-
-    cs.execute("SELECT COUNT(*) FROM supplier_case")
-    print("row_count:", cs.fetchone()[0])
-
-
 # ==============================================================================
 # SECTION 8: Weather Pipeline with 5-Digit ZIP Normalization
 # ==============================================================================
 
-def _show(cs, sql):
-    cs.execute(sql); return cs.fetchall()
-
 def find_relation_fqn(cs, name_upper: str):
-    """Find first DB.SCHEMA.OBJECT (TABLE or VIEW) named name_upper (case-insensitive)."""
-    for db in [r[1] for r in _show(cs, "SHOW DATABASES")]:
-        try:
-            for sch in [r[1] for r in _show(cs, f"SHOW SCHEMAS IN DATABASE {db}")]:
-                try:
-                    for t in [r[1] for r in _show(cs, f"SHOW TABLES IN SCHEMA {db}.{sch}")]:
-                        if t.upper() == name_upper.upper():
-                            return f"{db}.{sch}.{t}"
-                except: pass
-                try:
-                    for v in [r[1] for r in _show(cs, f"SHOW VIEWS IN SCHEMA {db}.{sch}")]:
-                        if v.upper() == name_upper.upper():
-                            return f"{db}.{sch}.{v}"
-                except: pass
-        except: pass
+    """Find first DB.SCHEMA.OBJECT (TABLE or VIEW) named name_upper (case-insensitive).
+
+    One SHOW OBJECTS ... IN ACCOUNT round trip; unlike ACCOUNT_USAGE.TABLES it
+    has no ingest lag and also lists objects in shared (Marketplace) databases.
+    """
+    cs.execute("SHOW OBJECTS LIKE %s IN ACCOUNT", (name_upper,))
+    cols = [d[0].lower() for d in cs.description]
+    i_name, i_db, i_sch = cols.index("name"), cols.index("database_name"), cols.index("schema_name")
+    for r in cs.fetchall():
+        # LIKE treats '_' as a wildcard, so confirm the exact name
+        if r[i_name].upper() == name_upper.upper():
+            return f"{r[i_db]}.{r[i_sch]}.{r[i_name]}"
     return None
 
+_DESC_CACHE = {}
+
 def desc_relation(cs, fqn: str):
-    """DESC TABLE first; fallback to DESC VIEW."""
-    try:
-        cs.execute(f"DESC TABLE {fqn}"); return cs.fetchall()
-    except:
-        cs.execute(f"DESC VIEW {fqn}");  return cs.fetchall()
+    """DESC TABLE first; fallback to DESC VIEW. Cached per fqn."""
+    if fqn not in _DESC_CACHE:
+        try:
+            cs.execute(f"DESC TABLE {fqn}"); _DESC_CACHE[fqn] = cs.fetchall()
+        except:
+            cs.execute(f"DESC VIEW {fqn}");  _DESC_CACHE[fqn] = cs.fetchall()
+    return _DESC_CACHE[fqn]
 
 def pick_col(cs, fqn: str, candidates):
     cols = {r[0].upper() for r in desc_relation(cs, fqn)}
@@ -529,26 +757,30 @@ def pick_col(cs, fqn: str, candidates):
 # --- REBUILD WEATHER PIPELINE WITH 5-DIGIT ZIP NORMALIZATION ---
 
 with conn.cursor() as cs:
-    # 7a) Supplier ZIPs (strict 5-digit from any ZIP+4 or messy strings)
+    # 7a) Supplier ZIPs (first 5 digits, ZIP+4 safe), normalized once into
+    #     supplier_zip5 for both this section and Section 9,
+    #     and ZCTA centroids (unchanged), in one request
     cs.execute("""
-        CREATE OR REPLACE VIEW VW_SUPPLIER_ZIPS AS
-        SELECT DISTINCT
-            LPAD(SUBSTR(REGEXP_REPLACE(TRIM("postalpostalcode"), '[^0-9]', ''), 1, 5), 5, '0') AS ZIP
+        CREATE OR REPLACE TABLE supplier_zip5 CLUSTER BY (zip5) AS
+        SELECT
+            "supplierid" AS supplier_id,
+            LPAD(SUBSTR(REGEXP_REPLACE(TRIM("postalpostalcode"), '[^0-9]', ''), 1, 5), 5, '0') AS zip5
         FROM supplier_case
         WHERE "postalpostalcode" IS NOT NULL
-          AND REGEXP_REPLACE(TRIM("postalpostalcode"), '[^0-9]', '') <> ''
-    """)
+          AND REGEXP_REPLACE(TRIM("postalpostalcode"), '[^0-9]', '') <> '';
+
+        CREATE OR REPLACE VIEW VW_SUPPLIER_ZIPS AS
+        SELECT DISTINCT zip5 AS ZIP
+        FROM supplier_zip5;
 
-    # ZCTA centroids unchanged
-    cs.execute("""
         CREATE OR REPLACE VIEW VW_ZIP_LATLON AS
         SELECT
           LPAD(TRIM(zcta5), 5, '0')        AS ZIP,
           TRY_TO_DOUBLE(centroid_lat)      AS ZIP_LAT,
           TRY_TO_DOUBLE(centroid_lon)      AS ZIP_LON
         FROM zcta_2021
-        WHERE zcta5 IS NOT NULL
-    """)
+        WHERE zcta5 IS NOT NULL;
+    """, num_statements=0)
 
     # Nearest station per ZIP
     stations_fqn   = find_relation_fqn(cs, "NOAA_WEATHER_STATION_INDEX")
@@ -561,19 +793,48 @@ with conn.cursor() as cs:
 
     cs.execute("""
         CREATE OR REPLACE VIEW VW_ZIP_STATION_NEAREST AS
-        WITH cand AS (
+        WITH st AS (
+          -- cast station coordinates once instead of per (ZIP, station) pair
           SELECT
-            zl.ZIP,
-            si.NOAA_WEATHER_STATION_ID,
-            2 * 6371 * ASIN(SQRT(
-              POWER(SIN(RADIANS((zl.ZIP_LAT - TRY_TO_DOUBLE(si.LATITUDE))/2)), 2) +
-              COS(RADIANS(zl.ZIP_LAT)) * COS(RADIANS(TRY_TO_DOUBLE(si.LATITUDE))) *
-              POWER(SIN(RADIANS((zl.ZIP_LON - TRY_TO_DOUBLE(si.LONGITUDE))/2)), 2)
-            )) AS DIST_KM
+            NOAA_WEATHER_STATION_ID,
+            TRY_TO_DOUBLE(LATITUDE)  AS ST_LAT,
+            TRY_TO_DOUBLE(LONGITUDE) AS ST_LON
+          FROM {stations_fqn}
+          WHERE LATITUDE IS NOT NULL AND LONGITUDE IS NOT NULL
+        ),
+        zips AS (
+          SELECT zl.ZIP, zl.ZIP_LAT, zl.ZIP_LON
           FROM VW_SUPPLIER_ZIPS sz
           JOIN VW_ZIP_LATLON zl ON zl.ZIP = sz.ZIP
-          JOIN {stations_fqn} si
-            ON si.LATITUDE IS NOT NULL AND si.LONGITUDE IS NOT NULL
+        ),
+        boxed AS (
+          -- cheap +/-2 degree bounding box prunes pairs before any trig is evaluated;
+          -- the longitude delta is wrapped into [-180, 180) so the box spans the antimeridian
+          SELECT z.ZIP, z.ZIP_LAT, z.ZIP_LON, st.NOAA_WEATHER_STATION_ID, st.ST_LAT, st.ST_LON
+          FROM zips z
+          JOIN st
+            ON st.ST_LAT BETWEEN z.ZIP_LAT - 2 AND z.ZIP_LAT + 2
+           AND ABS(MOD(st.ST_LON - z.ZIP_LON + 540, 360) - 180) <= 2 / COS(RADIANS(z.ZIP_LAT))
+        ),
+        pairs AS (
+          SELECT * FROM boxed
+          UNION ALL
+          -- ZIPs with no station inside the box fall back to searching every station
+          SELECT z.ZIP, z.ZIP_LAT, z.ZIP_LON, st.NOAA_WEATHER_STATION_ID, st.ST_LAT, st.ST_LON
+          FROM zips z
+          CROSS JOIN st
+          WHERE NOT EXISTS (SELECT 1 FROM boxed b WHERE b.ZIP = z.ZIP)
+        ),
+        cand AS (
+          SELECT
+            ZIP,
+            NOAA_WEATHER_STATION_ID,
+            2 * 6371 * ASIN(SQRT(
+              SIN(RADIANS((ZIP_LAT - ST_LAT)/2)) * SIN(RADIANS((ZIP_LAT - ST_LAT)/2)) +
+              COS(RADIANS(ZIP_LAT)) * COS(RADIANS(ST_LAT)) *
+              SIN(RADIANS((ZIP_LON - ST_LON)/2)) * SIN(RADIANS((ZIP_LON - ST_LON)/2))
+            )) AS DIST_KM
+          FROM pairs
         )
         SELECT ZIP, NOAA_WEATHER_STATION_ID
         FROM (
@@ -593,7 +854,8 @@ with conn.cursor() as cs:
 
     try:
         cs.execute(f"""
-            CREATE MATERIALIZED VIEW supplier_zip_code_weather AS
+            CREATE MATERIALIZED VIEW supplier_zip_code_weather
+            CLUSTER BY (ZIP, WX_DATE) AS
             SELECT
               z.ZIP,
               ts.{date_col}::DATE AS WX_DATE,
@@ -605,7 +867,8 @@ with conn.cursor() as cs:
         """)
     except Exception:
         cs.execute(f"""
-            CREATE TABLE supplier_zip_code_weather AS
+            CREATE TABLE supplier_zip_code_weather
+            CLUSTER BY (ZIP, WX_DATE) AS
             SELECT
               z.ZIP,
               ts.{date_col}::DATE AS WX_DATE,
@@ -625,36 +888,39 @@ with conn.cursor() as cs:
 # SECTION 9: Final Join - PO, Invoice, Supplier, and Weather Data
 # ==============================================================================
 
+FINAL_SELECT = """
+    SELECT
+        p.purchase_order_id,
+        p.supplier_id,
+        z.ZIP5                     AS zip_code,
+        p.transaction_date         AS wx_date,
+        p.po_total_amount,
+        p.amount_excluding_tax,
+        p.invoiced_vs_quoted,
+        w.HIGH_TEMP
+    FROM purchase_orders_and_invoices p
+    JOIN VW_SUPPLIER_ZIP5 z
+      ON z.supplier_id = p.supplier_id
+    JOIN supplier_zip_code_weather w
+      ON w.ZIP = z.ZIP5
+     AND w.WX_DATE = p.transaction_date
+"""
+
 with conn.cursor() as cs:
-    # 5-digit ZIP for suppliers (ZIP+4 safe)
-    cs.execute("""
+    # 5-digit ZIP for suppliers (precomputed in supplier_zip5), then rebuild the
+    # final table clustered on (supplier_id, wx_date). It is rebuilt rather than
+    # MERGEd past a date watermark: its sources are rebuilt every run, so
+    # back-dated invoices, late weather rows and edited PO months can change or
+    # remove rows at any date.
+    cs.execute(f"""
         CREATE OR REPLACE VIEW VW_SUPPLIER_ZIP5 AS
-        SELECT
-            "supplierid" AS supplier_id,
-            LPAD(SUBSTR(REGEXP_REPLACE(TRIM("postalpostalcode"),'[^0-9]',''),1,5),5,'0') AS zip5
-        FROM supplier_case
-        WHERE "postalpostalcode" IS NOT NULL AND TRIM("postalpostalcode") <> ''
-    """)
+        SELECT supplier_id, zip5
+        FROM supplier_zip5;
 
-    cs.execute("DROP TABLE IF EXISTS FINAL_PO_INV_SUPPLIER_WEATHER")
-    cs.execute("""
-        CREATE TABLE FINAL_PO_INV_SUPPLIER_WEATHER AS
-        SELECT
-            p.purchase_order_id,
-            p.supplier_id,
-            z.ZIP5                     AS zip_code,
-            p.transaction_date         AS wx_date,
-            p.po_total_amount,
-            p.amount_excluding_tax,
-            p.invoiced_vs_quoted,
-            w.HIGH_TEMP
-        FROM purchase_orders_and_invoices p
-        JOIN VW_SUPPLIER_ZIP5 z
-          ON z.supplier_id = p.supplier_id
-        JOIN supplier_zip_code_weather w
-          ON w.ZIP = z.ZIP5
-         AND w.WX_DATE = p.transaction_date
-    """)
+        CREATE OR REPLACE TABLE FINAL_PO_INV_SUPPLIER_WEATHER
+        CLUSTER BY (supplier_id, wx_date) AS
+        {FINAL_SELECT};
+    """, num_statements=0)
 
     cs.execute("SELECT COUNT(*) FROM FINAL_PO_INV_SUPPLIER_WEATHER")
     print("final joined rows:", cs.fetchone()[0])